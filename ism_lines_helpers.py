@@ -3,7 +3,8 @@ Implements helpers to process spectral lines formatted according to Meudon PDR c
 """
 
 import re
-from typing import List, Tuple, Union
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple, Union
 from warnings import warn
 
 __all__ = [
@@ -15,7 +16,8 @@ __all__ = [
     "molecules_among_lines",
     "molecule_to_latex",
     "transition_to_latex",
-    "line_to_latex"
+    "line_to_latex",
+    "lines_to_latex"
 ]
 
 
@@ -71,12 +73,48 @@ _energy_to_latex = {
     "kc": "k_c",
 }
 
+# Decimal part of half-integer energy levels to the number of halves to add
+_half_integers = {
+    "0": 0,
+    "5": 1,
+}
+
+# Prefix trie of molecular names and aliases (nested dicts, the key "$" marks a complete name and gives its reference name)
+_molecules_trie: Dict[str, Any] = {}
+for _name, _mol in [(mol, mol) for mol in _molecules_to_latex] + list(_molecules_aliases.items()):
+    _node = _molecules_trie
+    for _char in _name:
+        _node = _node.setdefault(_char, {})
+    _node["$"] = _mol
+del _name, _mol, _node, _char
+
+# Molecular names to all their accepted spellings (reference name and aliases)
+_molecules_spellings: Dict[str, Tuple[str, ...]] = {mol: (mol,) for mol in _molecules_to_latex}
+for _alias, _mol in _molecules_aliases.items():
+    _molecules_spellings[_mol] = _molecules_spellings.get(_mol, (_mol,)) + (_alias,)
+del _alias, _mol
+
+
+## Regular expressions
+
+# Energy level component of a transition (the matching alternative is given by `lastgroup`)
+# The pattern is not anchored with \A since it is matched at given positions with `match(string, pos)`
+_RE_LEVEL = re.compile(
+    r"(?:"
+    r"(?P<name>j|v|n|f|ka|kc)(?:(?P<lvl2>\d*_2)|(?P<lvld>\d*d\d*)|(?P<lvl>\d*))"
+    r"|el(?:(?P<elpo>\d*(po|so|do))|(?P<elp>\d*(p|s|d)))"
+    r"|(?P<fif>(pp|pm)_fif\d*)"
+    r")"
+)
+
 
 ## Public functions
 
+@lru_cache(maxsize=4096)
 def molecule_and_transition(line_name: str) -> Tuple[str, str]:
     """
     Returns the raw strings of the molecule name and the transition.
+    Molecule aliases are replaced by their reference name.
 
     Parameters
     ----------
@@ -95,17 +133,21 @@ def molecule_and_transition(line_name: str) -> Tuple[str, str]:
         raise ValueError(f'line_name {line_name} is not in the appropriate format molecule_transition')
     line_name = line_name.lower().strip()
 
-    # Search for all matching prefixes
-    prefixes = [s for s in _molecules_to_latex if line_name.startswith(s)]
-    if len(prefixes) == 0:
-        return tuple(line_name.split('_', maxsplit=1))
-
-    # Select the longest prefix
-    idxmax = lambda ls: max(range(len(ls)), key=ls.__getitem__)
-    prefix = prefixes[idxmax([len(s) for s in prefixes])]
+    # Search for the longest matching prefix
+    prefix, length = None, 0
+    node = _molecules_trie
+    for i, char in enumerate(line_name):
+        if char not in node:
+            break
+        node = node[char]
+        if "$" in node:
+            prefix, length = node["$"], i + 1
+    if prefix is None:
+        prefix, suffix = line_name.split('_', maxsplit=1)
+        return prefix, suffix
 
     # Select the remaining suffix
-    suffix = line_name[len(prefix)+1:]
+    suffix = line_name[length+1:]
 
     return prefix, suffix
 
@@ -155,7 +197,7 @@ def molecules_among_lines(names: List[str]) -> List[str]:
     List of str
         List of formatted molecules without duplicates.
     """
-    return list(dict.fromkeys([molecule_and_transition(name)[0] for name in names]))
+    return list(dict.fromkeys(molecule(name) for name in dict.fromkeys(names)))
 
 def is_line_of(name: str, mol: str) -> bool:
     """
@@ -174,6 +216,12 @@ def is_line_of(name: str, mol: str) -> bool:
         Whether `name` is a line of `mol`.
     """
     mol = mol.strip().lower()
+    mol = _molecules_aliases.get(mol, mol)
+
+    # Quickly reject lines that do not start with any spelling of `mol`
+    if mol in _molecules_spellings and not name.lower().strip().startswith(_molecules_spellings[mol]):
+        return False
+
     return molecule(name) == mol
 
 def filter_molecules(
@@ -197,20 +245,13 @@ def filter_molecules(
     if mols is None:
         return names
 
-    if isinstance(mols, str):
-        mols = [mols]
-    for i, mol in enumerate(mols):
-        mols[i] = mol.strip().lower()
-
-    mols = [(_molecules_aliases[mol] if mol in _molecules_aliases else mol) for mol in mols]
+    mols_set = _normalize_molecules((mols,) if isinstance(mols, str) else tuple(mols))
 
-    lines_mols = [molecule(name) for name in names]
-    indices = [i for i, line_mol in enumerate(lines_mols) if line_mol in mols]
-
-    return [names[i] for i in indices]
+    return [name for name in names if molecule(name) in mols_set]
 
+@lru_cache(maxsize=4096)
 def molecule_to_latex(molecule: str) -> str:
-    """
+    r"""
     Returns a well displayed version of the formatted molecule or radical `molecule`.
 
     Not addressed formats :
@@ -226,15 +267,12 @@ def molecule_to_latex(molecule: str) -> str:
     str
         LaTeX string representing `molecule`.
     """
-    if molecule in _molecules_to_latex:
-        latex_molecule = "${}$".format(_molecules_to_latex[molecule])
-    else:
-        latex_molecule = molecule
-
-    return latex_molecule
+    latex_molecule = _molecules_to_latex.get(molecule)
+    return f"${latex_molecule}$" if latex_molecule is not None else molecule
 
+@lru_cache(maxsize=4096)
 def transition_to_latex(transition: str) -> str:
-    """
+    r"""
     Returns a well displayed version of the formatted transition `transition`.
 
     Not addressed formats :
@@ -250,99 +288,44 @@ def transition_to_latex(transition: str) -> str:
     str
         LaTeX string representing `transition`.
     """
-    if transition.count("__") != 1:
+    levels = transition.split("__", 2)
+    if len(levels) != 2:
         raise ValueError(f"{transition} is not a valid transition because it does not contain one occurence of the double underscore")
-    high, low = transition.split("__")
+    high, low = levels
+
+    high_components, low_components = _tokenize(high), _tokenize(low)
+    if len(high_components) != len(low_components):
+        raise ValueError(f"{transition} is not a valid transition because the high and low levels do not contain the same number of variables")
 
     names = []
     high_lvls, low_lvls = [], []
-    while high != "" and low != "":
-
-        res_high = re.match("\A(j|v|n|f|ka|kc)\d*_2", high)
-        res_low = re.match("\A(j|v|n|f|ka|kc)\d*_2", low)
-        if res_high is not None and res_low is not None:
-            e_high, e_low = high[:res_high.end()], low[:res_low.end()]
-            n_high = re.match("\A(j|v|n|f|ka|kc)", e_high).group()
-            n_low = re.match("\A(j|v|n|f|ka|kc)", e_low).group()
-            if n_high != n_low:
-                raise ValueError("{transition} is not a valid transition because the energy level are not in the same order in the description of the high and low levels")
-            names.append(n_high)
-            high_lvls.append(_removeprefixes(e_high, n_high).replace('_', '/'))
-            low_lvls.append(_removeprefixes(e_low, n_low).replace('_', '/'))
-            high = _removeprefixes(high, e_high, '_')
-            low = _removeprefixes(low, e_low, '_')
-            continue
-
-        res_high = re.match("\A(j|v|n|f|ka|kc)\d*d\d*", high)
-        res_low = re.match("\A(j|v|n|f|ka|kc)\d*d\d*", low)
-        if res_high is not None and res_low is not None:
-            e_high, e_low = high[:res_high.end()], low[:res_low.end()]
-            n_high = re.match("\A(j|v|n|f|ka|kc)", e_high).group()
-            n_low = re.match("\A(j|v|n|f|ka|kc)", e_low).group()
-            if n_high != n_low:
-                raise ValueError("{transition} is not a valid transition because the energy level are not in the same order in the description of the high and low levels")
-            names.append(n_high)
-            high_lvls.append(_removeprefixes(e_high, n_high).replace('d', '.'))
-            low_lvls.append(_removeprefixes(e_low, n_low).replace('d', '.'))
-            high = _removeprefixes(high, e_high, '_')
-            low = _removeprefixes(low, e_low, '_')
-            continue
-
-        res_high = re.match("\A(j|v|n|f|ka|kc)\d*", high)
-        res_low = re.match("\A(j|v|n|f|ka|kc)\d*", low)
-        if res_high is not None and res_low is not None:
-            e_high, e_low = high[:res_high.end()], low[:res_low.end()]
-            n_high = re.match("\A(j|v|n|f|ka|kc)", e_high).group()
-            n_low = re.match("\A(j|v|n|f|ka|kc)", e_low).group()
+    for (kind, n_high, lvl_high), (kind_low, n_low, lvl_low) in zip(high_components, low_components):
+        if kind != kind_low:
+            raise ValueError(f"{transition} is not a valid transition because the energy levels are not of the same kind in the description of the high and low levels")
+
+        if kind in ("lvl2", "lvld", "lvl"):
             if n_high != n_low:
-                raise ValueError("{transition} is not a valid transition because the energy level are not in the same order in the description of the high and low levels")
+                raise ValueError(f"{transition} is not a valid transition because the energy level are not in the same order in the description of the high and low levels")
             names.append(n_high)
-            high_lvls.append(_removeprefixes(e_high, n_high))
-            low_lvls.append(_removeprefixes(e_low, n_low))
-            high = _removeprefixes(high, e_high, '_')
-            low = _removeprefixes(low, e_low, '_')
-            continue
-
-        res_high = re.match("\Ael\d*(po|so|do)", high)
-        res_low = re.match("\Ael\d*(po|so|do)", low)
-        if res_high is not None and res_low is not None:
-            e_high, e_low = high[:res_high.end()], low[:res_low.end()]
+            if kind == "lvl2":
+                lvl_high, lvl_low = lvl_high.replace('_', '/'), lvl_low.replace('_', '/')
+            elif kind == "lvld":
+                lvl_high, lvl_low = lvl_high.replace('d', '.'), lvl_low.replace('d', '.')
+            high_lvls.append(lvl_high)
+            low_lvls.append(lvl_low)
+
+        elif kind in ("elpo", "elp"):
             names.append("el")
-            high_lvls.append(e_high._removeprefixes("el"))
-            low_lvls.append(e_low._removeprefixes("el"))
-            high = _removeprefixes(high, e_high, '_')
-            low = _removeprefixes(low, e_low, '_')
-            continue
-
-        res_high = re.match("\Ael\d*(p|s|d)", high)
-        res_low = re.match("\Ael\d*(p|s|d)", low)
-        if res_high is not None and res_low is not None:
-            e_high, e_low = high[:res_high.end()], low[:res_low.end()]
-            names.append("el")
-            high_lvls.append(_removeprefixes(e_high, "el"))
-            low_lvls.append(_removeprefixes(e_low, "el"))
-            high = _removeprefixes(high, e_high, '_')
-            low = _removeprefixes(low, e_low, '_')
-            continue
-
-        res_high = re.match("\A(pp|pm)_fif\d*", high)
-        res_low = re.match("\A(pp|pm)_fif\d*", low)
-        if res_high is not None and res_low is not None:
-            e_high, e_low = high[:res_high.end()], low[:res_low.end()]
-            # names.append("el")
-            # high_lvls.append(_removeprefixes(e_high, "el"))
-            # low_lvls.append(_removeprefixes(e_low, "el"))
-            high = _removeprefixes(high, e_high, '_')
-            low = _removeprefixes(low, e_low, '_')
-            continue
-
-        if high == "" and low != "" or high != "" and low == "":
-            raise RuntimeError("high and low levels does not contain the same number of variables")
+            high_lvls.append(lvl_high)
+            low_lvls.append(lvl_low)
+
+        # The (pp|pm)_fif components are skipped
 
     return _sort_transitions(names, high_lvls, low_lvls)
 
+@lru_cache(maxsize=4096)
 def line_to_latex(line_name: str) -> str:
-    """
+    r"""
     Returns a well displayed version of the formatted line `line_name`.
 
     Not addressed formats :
@@ -371,25 +354,122 @@ def line_to_latex(line_name: str) -> str:
     out = out.replace("  ", " ") # Remove double spaces
     return out
 
+def lines_to_latex(names: List[str]) -> List[str]:
+    """
+    Returns a well displayed version of each formatted line in `names`.
+
+    Parameters
+    ----------
+    names : list of str
+        List of formatted lines.
+
+    Returns
+    -------
+    List of str
+        List of LaTeX strings representing the lines of `names`.
+    """
+    latex_names: Dict[str, str] = {}
+    out = []
+    for name in names:
+        latex_name = latex_names.get(name)
+        if latex_name is None:
+            latex_name = latex_names[name] = line_to_latex(name)
+        out.append(latex_name)
+    return out
+
 
 # Local functions
 
-def _removeprefixes(string: str, *prefixes: str) -> str:
+def _tokenize(levels: str) -> List[Tuple[str, str, str]]:
+    r"""
+    Splits the formatted energy levels `levels` into their components.
+
+    Parameters
+    ----------
+    levels : str
+        Formatted energy levels, i.e. one side of a transition.
+
+    Returns
+    -------
+    list of tuple of str
+        Kind (name of the matching group of `_RE_LEVEL`), energy name (empty for electronic configurations and '(pp|pm)_fif\d*') and raw level of each component.
+    """
+    components = []
+    pos = 0
+    while pos < len(levels):
+        res = _RE_LEVEL.match(levels, pos)
+        if res is None:
+            raise ValueError(f"{levels} is not a valid energy level description because {levels[pos:]} cannot be parsed")
+        kind = res.lastgroup or "" # Each alternative ends with a named group
+        components.append((kind, res.group("name") or "", res.group(kind)))
+        pos = res.end()
+        if levels[pos:pos+1] == '_':
+            pos += 1
+    return components
+
+@lru_cache(maxsize=256)
+def _normalize_molecules(mols: Tuple[str, ...]) -> FrozenSet[str]:
     """
-    Return a str with the given prefix string removed if present.
+    Returns the set of formatted molecules `mols` in lower case with aliases replaced by their reference name.
 
-    Return a copy of `string` with the prefixes `prefixes` removed iteratively if they exists.
+    Parameters
+    ----------
+    mols : tuple of str
+        Molecules.
 
-    Note
-    ----
+    Returns
+    -------
+    frozenset of str
+        Normalized molecules.
+    """
+    return frozenset(_molecules_aliases.get(name, name) for name in (mol.strip().lower() for mol in mols))
 
-    This method doesn't use the builtin method `removeprefix` to ensure the code to be available to users with `Python < 3.9`.
+def _number_separator(string: str) -> Optional[str]:
     """
-    for prefix in prefixes:
-        if string.startswith(prefix):
-            string = string[len(prefix):]
-    return string[:]
+    Returns the separator of `string` if it is made of two integers separated by '/' or '.', else None.
 
+    Parameters
+    ----------
+    string : str
+        Energy level.
+
+    Returns
+    -------
+    str or None
+        Separator '/' or '.' if `string` is a fraction or a decimal number, else None.
+    """
+    for separator in "/.":
+        if separator in string:
+            a, _, b = string.partition(separator)
+            return separator if a.isdigit() and b.isdigit() else None
+    return None
+
+def _decimal_to_fraction(integer: str, decimal: str) -> Tuple[int, int]:
+    """
+    Returns the numerator and the denominator of the number `integer`.`decimal`.
+    Only integers and half-integers are addressed, the decimal part is ignored otherwise.
+
+    Parameters
+    ----------
+    integer : str
+        Integer part.
+    decimal : str
+        Decimal part.
+
+    Returns
+    -------
+    int
+        Numerator.
+    int
+        Denominator.
+    """
+    half = _half_integers.get(decimal)
+    if half is None:
+        warn(f"x.{decimal} floats has not been implemented. Ignoring the floating part.")
+        return int(integer), 1 # Default behavior
+    return 2*int(integer) + half, 2
+
+@lru_cache(maxsize=1024)
 def _transition(
     name: str, high_lvl: str, low_lvl: str
 ) -> Tuple[Union[str, Tuple[str, str]], bool]:
@@ -412,36 +492,19 @@ def _transition(
     bool
         True if it is a transition, else False
     """
-    if name in _energy_to_latex:
-        name_latex = _energy_to_latex[name]
-    else:
-        name_latex = name
+    name_latex = _energy_to_latex.get(name, name)
 
-    if re.match("\A\d*[/.]\d*\Z", high_lvl) is not None:
-        if '/' in high_lvl:
-            a_high, b_high = high_lvl.split('/')
-            a_low, b_low = low_lvl.split('/')
+    separator = _number_separator(high_lvl)
+    if separator is not None:
+        a_high, b_high = high_lvl.split(separator)
+        a_low, b_low = low_lvl.split(separator)
 
+        if separator == '/':
             n_high, d_high = int(a_high), int(b_high)
             n_low, d_low = int(a_low), int(b_low)
         else:
-            a_high, b_high = high_lvl.split('.')
-            a_low, b_low = low_lvl.split('.')
-
-            if b_high == "0": 
-                n_high, d_high = 2*int(a_high), 1
-            elif b_high == "5":
-                n_high, d_high = 2*int(a_high)+1, 2
-            else:
-                warn(f"x.{b_high} floats has not been implemented. Ignoring the floating part.")
-                n_high, d_high = int(a_high), 1 # Default behavior
-            if b_low == "0": 
-                n_low, d_low = 2*int(a_low), 1
-            elif b_low == "5":
-                n_low, d_low = 2*int(a_low)+1, 2
-            else:
-                warn(f"x.{b_low} floats has not been implemented. Ignoring the floating part.")
-                n_low, d_low = int(a_low), 1 # Default behavior
+            n_high, d_high = _decimal_to_fraction(a_high, b_high)
+            n_low, d_low = _decimal_to_fraction(a_low, b_low)
 
         if n_high % d_high == 0:
             high_lvl_latex = f"{n_high // d_high}"
@@ -462,6 +525,7 @@ def _transition(
         "${}={}$".format(name_latex, low_lvl_latex),
     ), True
 
+@lru_cache(maxsize=1024)
 def _eltransition(high: str, low: str) -> Tuple[Union[str, Tuple[str, str]], bool]:
     """
     Returns a LaTeX string representing an electronic transition.
@@ -486,7 +550,7 @@ def _eltransition(high: str, low: str) -> Tuple[Union[str, Tuple[str, str]], boo
 
 
 def _sort_transitions(
-    names: List[str], high_lvls: List[int], low_lvls: List[int]
+    names: List[str], high_lvls: List[str], low_lvls: List[str]
 ) -> str:
     """
     Returns a LaTeX string representing the energy transitions.
@@ -496,9 +560,9 @@ def _sort_transitions(
     ----------
     names : list of str
         Energies names.
-    high_lvls : list of int
+    high_lvls : list of str
         List of higher level for each energy.
-    low_lvls : List of int.
+    low_lvls : List of str.
         List of lower level for each energy.
 
     Returns
@@ -514,16 +578,18 @@ def _sort_transitions(
     # if len(names) == 1:
     #     return _transition(None, high_lvls[0], low_lvls[0])
 
-    descr_0, descr_1a, descr_1b = "", "", ""
+    descr_0: List[str] = []
+    descr_1a: List[str] = []
+    descr_1b: List[str] = []
     for name, high, low in zip(names, high_lvls, low_lvls):
         if name == "el":
-            descr, istrans = _eltransition(high, low)
+            descr, _ = _eltransition(high, low)
         else:
-            descr, istrans = _transition(name, high, low)
-        if istrans:
-            descr_1a += descr[0] + ", "
-            descr_1b += descr[1] + ", "
+            descr, _ = _transition(name, high, low)
+        if isinstance(descr, tuple):
+            descr_1a.append(descr[0])
+            descr_1b.append(descr[1])
         else:
-            descr_0 += descr + " "
+            descr_0.append(descr)
     return "{} ({} $\\to$ {})"\
-        .format(descr_0.strip(), descr_1a[:-2], descr_1b[:-2])
+        .format(" ".join(descr_0), ", ".join(descr_1a), ", ".join(descr_1b))
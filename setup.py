@@ -0,0 +1,24 @@
+"""
+Optional build script compiling `ism_lines_helpers.py` to a C extension with mypyc.
+
+The extension is built next to the source file with
+
+    pip install mypy
+    python setup.py build_ext --inplace
+
+If mypyc is not available, no extension is built and the pure Python module is used.
+"""
+
+from setuptools import setup
+
+try:
+    from mypyc.build import mypycify
+    ext_modules = mypycify(["ism_lines_helpers.py"])
+except ImportError:
+    ext_modules = []
+
+setup(
+    name="ism-lines-helpers",
+    py_modules=["ism_lines_helpers"],
+    ext_modules=ext_modules,
+)